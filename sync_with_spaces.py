@@ -1,7 +1,20 @@
-from huggingface_hub import create_repo, whoami, HfApi, CommitOperationAdd, CommitOperationDelete
 import os
+
+# Let hf_xet use all cores and more concurrent transfers for uploads. Must be set
+# before huggingface_hub is imported, and can still be overridden from the environment.
+os.environ.setdefault("HF_XET_HIGH_PERFORMANCE", "1")
+
+from huggingface_hub import create_repo, whoami, HfApi, CommitOperationAdd, CommitOperationDelete  # noqa: E402
+import re
+import json
 import fnmatch
+import functools
 import hashlib
+import heapq
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
 
 
 def _to_bool(value):
@@ -12,51 +25,164 @@ def _to_bool(value):
     return False
 
 
-def _is_ignored(path_in_repo: str, ignore_patterns: list[str]) -> bool:
-    """Check if a path should be ignored based on patterns."""
-    base = os.path.basename(path_in_repo)
-    for pat in ignore_patterns:
-        if fnmatch.fnmatch(path_in_repo, pat) or fnmatch.fnmatch(base, pat):
-            return True
-    return False
+_GLOB_CHARS = "*?["
 
+# Plain substrings taken from "*literal*" patterns, a regex for any other globs
+# matched against the full path, and one for those also matched against the basename
+_IgnoreRules = tuple[tuple[str, ...], Optional[re.Pattern], Optional[re.Pattern]]
 
-def _list_local_files(directory: str, ignore_patterns: list[str]) -> set[str]:
-    """List all non-ignored files in a directory."""
-    out: set[str] = set()
-    directory = os.path.abspath(directory)
-
-    for root, dirs, files in os.walk(directory):
-        rel_root = os.path.relpath(root, directory)
-        if rel_root == ".":
-            rel_root = ""
-
-        # Skip ignored directories early (e.g. ".github")
-        kept_dirs = []
-        for d in dirs:
-            rel_dir = os.path.join(rel_root, d) if rel_root else d
-            rel_dir_norm = rel_dir.replace(os.sep, "/")
-            if not _is_ignored(rel_dir_norm, ignore_patterns):
-                kept_dirs.append(d)
-        dirs[:] = kept_dirs
-
-        for f in files:
-            rel_file = os.path.join(rel_root, f) if rel_root else f
-            rel_file_norm = rel_file.replace(os.sep, "/")
-            if _is_ignored(rel_file_norm, ignore_patterns):
-                continue
-            out.add(rel_file_norm)
 
+@functools.lru_cache(maxsize=1024)
+def _translate_glob(pattern: str) -> str:
+    """Translate a glob pattern into a regex, caching the result."""
+    return fnmatch.translate(pattern)
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_globs(globs: tuple[str, ...]) -> Optional[re.Pattern]:
+    """Compile glob patterns into a single regex, or None if there are none."""
+    return re.compile("|".join(_translate_glob(pat) for pat in globs)) if globs else None
+
+
+def _compile_ignore_patterns(ignore_patterns: list[str]) -> _IgnoreRules:
+    """Compile glob patterns, turning "*literal*" ones into substring checks."""
+    substrings = []
+    globs = []
+    for pat in ignore_patterns:
+        inner = pat[1:-1]
+        if len(pat) > 2 and pat[0] == "*" and pat[-1] == "*" and not any(c in inner for c in _GLOB_CHARS):
+            # "*literal*" matches the basename only if it matches the full path
+            substrings.append(inner)
+        else:
+            globs.append(pat)
+
+    # Same for any pattern starting with "*", so only the others need the basename check
+    base_globs = tuple(pat for pat in globs if not pat.startswith("*"))
+    return tuple(substrings), _compile_globs(tuple(globs)), _compile_globs(base_globs)
+
+
+def _is_ignored(path_in_repo: str, ignore_rules: _IgnoreRules) -> bool:
+    """Check if a path should be ignored based on the compiled patterns."""
+    substrings, path_re, base_re = ignore_rules
+    for sub in substrings:
+        if sub in path_in_repo:
+            return True
+    if path_re is not None and path_re.match(path_in_repo):
+        return True
+    return base_re is not None and bool(base_re.match(os.path.basename(path_in_repo)))
+
+
+def _filter_ignored(paths: set[str], ignore_rules: _IgnoreRules) -> set[str]:
+    """Return the paths that are not ignored, filtering the whole set per pattern."""
+    substrings, path_re, base_re = ignore_rules
+    kept = set(paths)
+    for sub in substrings:
+        kept = {p for p in kept if sub not in p}
+    if path_re is not None:
+        match = path_re.match
+        kept = {p for p in kept if not match(p)}
+    if base_re is not None:
+        match = base_re.match
+        kept = {p for p in kept if not match(p.rpartition("/")[2])}
+    return kept
+
+
+def _walk_local_files(dirpath: str, rel_prefix: str, ignore_rules: _IgnoreRules, out: dict[str, int]) -> None:
+    """Recursively collect sizes of non-ignored files, keyed by POSIX path prefixed with rel_prefix."""
+    with os.scandir(dirpath) as it:
+        for entry in it:
+            rel_path = rel_prefix + entry.name
+            if _is_ignored(rel_path, ignore_rules):
+                continue
+            if entry.is_dir():
+                # Like os.walk, don't descend into symlinked directories
+                if not entry.is_symlink():
+                    _walk_local_files(entry.path, rel_path + "/", ignore_rules, out)
+            else:
+                out[rel_path] = entry.stat().st_size
+
+
+def _list_local_files(directory: str, ignore_rules: _IgnoreRules) -> dict[str, int]:
+    """List all non-ignored files in a directory, with their sizes."""
+    out: dict[str, int] = {}
+    # Skips ignored directories early (e.g. ".github")
+    _walk_local_files(os.path.abspath(directory), "", ignore_rules, out)
     return out
 
 
-def _get_file_hash(filepath: str) -> str:
-    """Calculate SHA256 hash of a file."""
-    sha256_hash = hashlib.sha256()
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hf-sync-action")
+_CACHE_MAX_ENTRIES = 5  # Cached revisions kept per repo
+
+
+def _list_remote_files(
+    api: HfApi, repo_id: str, repo_type: str
+) -> tuple[set[str], dict[str, tuple[Optional[str], Optional[str], Optional[int]]]]:
+    """List remote files with their (LFS SHA256, git blob id, size), cached on disk by the repo's head commit."""
+    revision = api.repo_info(repo_id=repo_id, repo_type=repo_type).sha
+    cache_dir = os.path.join(_CACHE_DIR, repo_type, repo_id)
+    cache_path = os.path.join(cache_dir, f"{revision}.json")
+
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        os.utime(cache_path)  # Mark as recently used
+        print(f"\t- Using cached remote metadata for revision {revision}")
+        remote_file_info = {path: tuple(info) for path, info in cached["siblings"].items()}
+        return set(remote_file_info), remote_file_info
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Siblings list every file in the repo, along with the SHA256 of LFS files,
+    # git blob ids and sizes, so there's no need to list files separately or download them
+    repo_info = api.repo_info(repo_id=repo_id, repo_type=repo_type, revision=revision, files_metadata=True)
+    remote_file_info = {
+        file_info.rfilename: (
+            file_info.lfs.sha256 if file_info.lfs is not None else None,
+            file_info.blob_id,
+            file_info.size,
+        )
+        for file_info in repo_info.siblings or []
+    }
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"siblings": remote_file_info}, f)
+        os.replace(tmp_path, cache_path)
+
+        # Evict the least recently used revisions
+        entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".json")]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for stale_path in entries[_CACHE_MAX_ENTRIES:]:
+            os.remove(stale_path)
+    except OSError as e:
+        print(f"\t  - WARNING: Could not cache remote metadata: {e}")
+
+    return set(remote_file_info), remote_file_info
+
+
+def _get_git_blob_hash(filepath: str) -> str:
+    """Calculate the git blob id (SHA1 of header and content) of a file."""
     with open(filepath, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+        size = os.fstat(f.fileno()).st_size
+        sha1_hash = hashlib.sha1(f"blob {size}\0".encode())
+        # Empty files can't be memory-mapped
+        if size == 0:
+            return sha1_hash.hexdigest()
+
+        # Hash straight from the page cache instead of copying blocks into Python bytes
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            sha1_hash.update(mm)
+    return sha1_hash.hexdigest()
+
+
+def _print_first_paths(action: str, paths, limit: int = 10) -> None:
+    """Print the first few paths in sorted order, without sorting all of them."""
+    for path in heapq.nsmallest(limit, paths):
+        print(f"\t  - {action}: {path}")
+    if len(paths) > limit:
+        print(f"\t  - ... and {len(paths) - limit} more")
 
 
 def main(
@@ -90,88 +216,94 @@ def main(
     print(f"\t- Repo URL: {url}")
 
     ignore_patterns = ["*.git*", "*.github*"]
+    ignore_rules = _compile_ignore_patterns(ignore_patterns)
 
     api = HfApi(token=token)
 
+    # Fetch the remote listing in the background while the local tree is walked and hashed
+    remote_executor = ThreadPoolExecutor(max_workers=1)
+    remote_listing = remote_executor.submit(_list_remote_files, api, repo_id, repo_type)
+    remote_executor.shutdown(wait=False)
+
     # List local files (filtered)
-    local_files = _list_local_files(directory, ignore_patterns)
+    local_files = _list_local_files(directory, ignore_rules)
     print(f"\t- Local files found: {len(local_files)}")
 
-    # List remote files (all files)
-    remote_files_all = set(api.list_repo_files(repo_id=repo_id, repo_type=repo_type))
-    print(f"\t- Remote files (before filtering): {len(remote_files_all)}")
-    
-    # Filter remote files to exclude ignored patterns
-    remote_files = {p for p in remote_files_all if not _is_ignored(p, ignore_patterns)}
-    print(f"\t- Remote files (after filtering): {len(remote_files)}")
+    # Every local file ends up either in an add operation or in the change check,
+    # both of which need its SHA256. CommitOperationAdd computes it, so start
+    # building the operations in parallel now, while the remote side is listed.
+    # Workers are spawned rather than forked, since the remote listing thread is running
+    executor = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # Largest files first, so that a big file doesn't start hashing last and
+        # leave the other workers idle
+        local_paths = sorted(local_files, key=local_files.get, reverse=True)
+        pending_operations = executor.map(
+            CommitOperationAdd,
+            local_paths,
+            [os.path.join(directory, path) for path in local_paths],
+            chunksize=4,
+        )
+
+        # List remote files (all files) and their metadata
+        remote_files_all, remote_file_info = remote_listing.result()
+        print(f"\t- Remote files (before filtering): {len(remote_files_all)}")
+
+        # Filter remote files to exclude ignored patterns
+        remote_files = _filter_ignored(remote_files_all, ignore_rules)
+        print(f"\t- Remote files (after filtering): {len(remote_files)}")
+
+        local_operations = dict(zip(local_paths, pending_operations))
+    finally:
+        executor.shutdown(cancel_futures=True)
 
     operations = []
 
     # Deletions: anything remote (not ignored) that no longer exists locally
-    files_to_delete = remote_files - local_files
+    files_to_delete = remote_files - local_files.keys()
     if files_to_delete:
         print(f"\t- Files to delete: {len(files_to_delete)}")
-        for path in sorted(files_to_delete):
-            print(f"\t  - DELETE: {path}")
+        _print_first_paths("DELETE", files_to_delete)
+        for path in files_to_delete:
             operations.append(CommitOperationDelete(path_in_repo=path))
 
     # Add new files: files that exist locally but not remotely
-    files_to_add = local_files - remote_files
+    files_to_add = local_files.keys() - remote_files
     if files_to_add:
         print(f"\t- Files to add: {len(files_to_add)}")
-        for path in sorted(files_to_add):
-            operations.append(
-                CommitOperationAdd(
-                    path_in_repo=path,
-                    path_or_fileobj=os.path.join(directory, path),
-                )
-            )
+        for path in files_to_add:
+            operations.append(local_operations[path])
 
     # Check for modified files: files that exist in both places
-    files_in_both = local_files & remote_files
+    files_in_both = local_files.keys() & remote_files
     if files_in_both:
         print(f"\t- Checking {len(files_in_both)} existing files for changes...")
         files_modified = []
 
-        for path in sorted(files_in_both):
-            local_path = os.path.join(directory, path)
-            local_hash = _get_file_hash(local_path)
-
-            # Download remote file and compare hash
-            try:
-                remote_content = api.hf_hub_download(
-                    repo_id=repo_id,
-                    repo_type=repo_type,
-                    filename=path,
-                    token=token,
-                )
-                remote_hash = _get_file_hash(remote_content)
-
-                if local_hash != remote_hash:
-                    files_modified.append(path)
-                    operations.append(
-                        CommitOperationAdd(
-                            path_in_repo=path,
-                            path_or_fileobj=local_path,
-                        )
-                    )
-            except Exception as e:
-                # If we can't download/compare, assume it needs updating
-                print(f"\t  - WARNING: Could not compare {path}, will update: {e}")
+        for path in files_in_both:
+            operation = local_operations[path]
+            remote_hash, remote_blob_id, remote_size = remote_file_info.get(path, (None, None, None))
+
+            if remote_size is not None and operation.upload_info.size != remote_size:
+                # A different size means different content, no need to compare hashes
+                changed = True
+            elif remote_hash is not None:
+                changed = operation.upload_info.sha256.hex() != remote_hash
+            elif remote_blob_id is not None:
+                # Not an LFS file: compare with the git blob id instead of downloading it
+                changed = _get_git_blob_hash(operation.path_or_fileobj) != remote_blob_id
+            else:
+                # If we can't compare, assume it needs updating
+                print(f"\t  - WARNING: Could not compare {path}, will update: no remote hash")
+                changed = True
+
+            if changed:
                 files_modified.append(path)
-                operations.append(
-                    CommitOperationAdd(
-                        path_in_repo=path,
-                        path_or_fileobj=local_path,
-                    )
-                )
+                operations.append(operation)
 
         if files_modified:
             print(f"\t- Files modified: {len(files_modified)}")
-            for path in files_modified[:10]:  # Show first 10
-                print(f"\t  - UPDATE: {path}")
-            if len(files_modified) > 10:
-                print(f"\t  - ... and {len(files_modified) - 10} more")
+            _print_first_paths("UPDATE", files_modified)
 
     print(f"\t- Total operations: {len(operations)}")
 
@@ -184,6 +316,8 @@ def main(
         repo_type=repo_type,
         operations=operations,
         commit_message="Sync from GitHub via huggingface-sync-action",
+        # Uploads are I/O-bound, so use more upload threads than cores
+        num_threads=4 * (os.cpu_count() or 1),
     )
     print("\t- Repo synced")
 